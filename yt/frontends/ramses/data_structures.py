@@ -21,6 +21,7 @@ import stat
 import weakref
 from collections import defaultdict
 from glob import glob
+from multiprocessing.pool import ThreadPool
 
 from yt.extern.six import string_types
 from yt.funcs import \
@@ -42,30 +43,46 @@ from .fields import \
     RAMSESFieldInfo, _X
 from .hilbert import get_cpu_list
 from .particle_handlers import get_particle_handlers
-from .field_handlers import get_field_handlers
+from .field_handlers import get_field_handlers, FieldFileHandler
 from yt.utilities.cython_fortran_utils import FortranFile as fpu
 from yt.geometry.oct_container import \
     RAMSESOctreeContainer
-from yt.arraytypes import blankRecordArray
 
 from yt.utilities.lib.cosmology_time import \
     friedman
+from yt.utilities.lru_cache import lru_cache
 
-from .io_utils import read_amr, fill_hydro
+from .io import _get_num_io_threads, _list_directory
+from .io_utils import read_amr_grids, add_amr_grids, fill_hydro
+
+AMR_BUFFER_SIZE = 1 << 20
+
+# Outputs already recognized by RAMSESDataset._is_valid
+VALID_OUTPUTS = set()
+
+
+@lru_cache(maxsize=32)
+def _cached_friedman(O_mat_0, O_vac_0, O_k_0):
+    """Compute the friedman lookup tables once per cosmology.
+
+    The tables are shared between datasets, so they are made read-only."""
+    tau_out, t_out, delta_tau, ntable, age_tot = friedman(
+        O_mat_0, O_vac_0, O_k_0)
+    tau_out.flags.writeable = False
+    t_out.flags.writeable = False
+    return tau_out, t_out, delta_tau, ntable, age_tot
 
 class RAMSESDomainFile(object):
     _last_mask = None
     _last_selector_id = None
 
-    def __init__(self, ds, domain_id):
+    def __init__(self, ds, domain_id, storage=None, lazy=False):
         self.ds = ds
         self.domain_id = domain_id
 
-        num = os.path.basename(ds.parameter_filename).split("."
-                )[0].split("_")[1]
+        num = "%05i" % ds._iout
         rootdir = ds.root_folder
-        basedir = os.path.abspath(
-            os.path.dirname(ds.parameter_filename))
+        basedir = ds._output_dir
         basename = "%s/%%s_%s.out%05i" % (
             basedir, num, domain_id)
         part_file_descriptor = "%s/part_file_descriptor.txt" % basedir
@@ -82,9 +99,7 @@ class RAMSESDomainFile(object):
         self._read_amr_header()
 
         # Autodetect field files
-        field_handlers = [FH(self)
-                          for FH in get_field_handlers()
-                          if FH.any_exist(ds)]
+        field_handlers = [FH(self) for FH in ds._active_field_handlers]
         self.field_handlers = field_handlers
         for fh in field_handlers:
             mylog.debug('Detected fluid type %s in domain_id=%s' % (fh.ftype, domain_id))
@@ -93,100 +108,151 @@ class RAMSESDomainFile(object):
 
         # Autodetect particle files
         particle_handlers = [PH(ds, self)
-                             for PH in get_particle_handlers()
-                             if PH.any_exist(ds)]
+                             for PH in ds._active_particle_handlers]
         self.particle_handlers = particle_handlers
         for ph in particle_handlers:
             mylog.debug('Detected particle type %s in domain_id=%s' % (ph.ptype, domain_id))
             ph.read_header()
             # self._add_ptype(ph.ptype)
 
-        # Load the AMR structure
-        self._read_amr()
+        # Load the AMR structure, unless it is deferred until the first
+        # access to the octree
+        self._storage = storage
+        if not lazy:
+            self._read_amr(storage)
 
     _hydro_offset = None
     _level_count = None
+    _oct_handler = None
+    _max_level = None
 
     def __repr__(self):
         return "RAMSESDomainFile: %i" % self.domain_id
 
     @property
     def level_count(self):
+        if self._level_count is not None:
+            return self._level_count
         lvl_count = None
         for fh in self.field_handlers:
-            fh.offset
+            # This computes (and caches) the offsets of the file if needed
             if lvl_count is None:
                 lvl_count = fh.level_count.copy()
             else:
-                lvl_count += fh._level_count
+                lvl_count += fh.level_count
+        self._level_count = lvl_count
         return lvl_count
 
     @property
-    def amr_file(self):
-        if hasattr(self, '_amr_file'):
-            self._amr_file.seek(0)
-            return self._amr_file
+    def oct_handler(self):
+        if self._oct_handler is None:
+            self._read_amr(self._storage)
+        return self._oct_handler
 
-        f = fpu(self.amr_fn)
-        self._amr_file = f
-        f.seek(0)
-        return f
+    @property
+    def max_level(self):
+        if self._max_level is None:
+            self._read_amr(self._storage)
+        return self._max_level
+
+    @property
+    def amr_file(self):
+        # The AMR file is read sequentially in many small records, use
+        # a large buffer to reduce the number of actual reads. A new
+        # handle is returned on each access and closed by the caller,
+        # so that domains with a deferred tree don't keep it open.
+        return fpu(self.amr_fn, buffer_size=AMR_BUFFER_SIZE)
 
     def _read_amr_header(self):
         hvals = {}
-        f = self.amr_file
-        f.seek(0)
-
-        for header in ramses_header(hvals):
-            hvals.update(f.read_attrs(header))
-        # For speedup, skip reading of 'headl' and 'taill'
-        f.skip(2)
-        hvals['numbl'] = f.read_vector('i')
-
-        # That's the header, now we skip a few.
-        hvals['numbl'] = np.array(hvals['numbl']).reshape(
-            (hvals['nlevelmax'], hvals['ncpu']))
-        f.skip()
-        if hvals['nboundary'] > 0:
+        with self.amr_file as f:
+            for header in ramses_header(hvals):
+                hvals.update(f.read_attrs(header))
+            # For speedup, skip reading of 'headl' and 'taill'
             f.skip(2)
-            self.ngridbound = f.read_vector('i').astype("int64")
-        else:
-            self.ngridbound = np.zeros(hvals['nlevelmax'], dtype='int64')
-        free_mem = f.read_attrs((('free_mem', 5, 'i'), ) )  # NOQA
-        ordering = f.read_vector('c')  # NOQA
-        f.skip(4)
+            hvals['numbl'] = f.read_vector('i')
+
+            # That's the header, now we skip a few.
+            hvals['numbl'] = np.array(hvals['numbl']).reshape(
+                (hvals['nlevelmax'], hvals['ncpu']))
+            f.skip()
+            if hvals['nboundary'] > 0:
+                f.skip(2)
+                self.ngridbound = f.read_vector('i').astype("int64")
+            else:
+                self.ngridbound = np.zeros(hvals['nlevelmax'], dtype='int64')
+            # Skip free memory, ordering, bound keys, coarse son, flag1
+            # and cpu map.  The size of the bound keys depends on the
+            # ordering, so let the records tell us their length.
+            f.skip(6)
+            self.amr_offset = f.tell()
         # Now we're at the tree itself
         # Now we iterate over each level and each CPU.
         self.amr_header = hvals
-        self.amr_offset = f.tell()
-        self.local_oct_count = hvals['numbl'][self.ds.min_level:, self.domain_id - 1].sum()
-        self.total_oct_count = hvals['numbl'][self.ds.min_level:,:].sum(axis=0)
+        # numbl is int32, sum as int64 to avoid overflows on large runs
+        self.total_oct_count = hvals['numbl'][self.ds.min_level:,:].sum(
+            axis=0, dtype=np.int64)
+        self.local_oct_count = self.total_oct_count[self.domain_id - 1]
 
-    def _read_amr(self):
+    def _read_amr(self, storage=None):
         """Open the oct file, read in octs level-by-level.
            For each oct, only the position, index, level and domain
            are needed - its position in the octree is found automatically.
            The most important is finding all the information to feed
            oct_handler.add
+
+           If *storage* (the index) is given, the grid positions are
+           loaded from/saved to its data file, if any.
         """
-        self.oct_handler = RAMSESOctreeContainer(self.ds.domain_dimensions/2,
+        oct_handler = RAMSESOctreeContainer(self.ds.domain_dimensions/2,
                 self.ds.domain_left_edge, self.ds.domain_right_edge)
         root_nodes = self.amr_header['numbl'][self.ds.min_level,:].sum()
-        self.oct_handler.allocate_domains(self.total_oct_count, root_nodes)
-        mylog.debug("Reading domain AMR % 4i (%0.3e, %0.3e)",
-            self.domain_id, self.total_oct_count.sum(), self.ngridbound.sum())
+        oct_handler.allocate_domains(self.total_oct_count, root_nodes)
+
+        grids = None
+        if storage is not None:
+            grids = self._load_amr_grids(storage)
 
-        f = self.amr_file
-        f.seek(self.amr_offset)
+        if grids is None:
+            mylog.debug("Reading domain AMR % 4i (%0.3e, %0.3e)",
+                self.domain_id, self.total_oct_count.sum(), self.ngridbound.sum())
+            with self.amr_file as f:
+                f.seek(self.amr_offset)
+                grids = read_amr_grids(f, self.amr_header, self.ngridbound)
+            if storage is not None:
+                self._save_amr_grids(storage, *grids)
 
         min_level = self.ds.min_level
-        max_level = read_amr(f, self.amr_header, self.ngridbound, min_level, self.oct_handler)
+        blocks, pos = grids
+        max_level = add_amr_grids(oct_handler, blocks, pos, min_level)
+        oct_handler.finalize()
 
-        self.max_level = max_level
-        self.oct_handler.finalize()
+        self._max_level = max_level
+        self._oct_handler = oct_handler
 
-        # Close AMR file
-        f.close()
+    @property
+    def _amr_storage_node(self):
+        return "/RAMSES/domain_%05i" % self.domain_id
+
+    def _amr_file_stat(self):
+        st = os.stat(self.amr_fn)
+        return np.array([st.st_size, st.st_mtime], dtype='float64')
+
+    def _load_amr_grids(self, storage):
+        node = self._amr_storage_node
+        amr_stat = storage.get_data(node, "amr_stat")
+        if amr_stat is None or not np.all(amr_stat == self._amr_file_stat()):
+            return None
+        mylog.debug("Loading domain AMR % 4i from %s",
+                    self.domain_id, storage._data_file.filename)
+        return (storage.get_data(node, "blocks"),
+                storage.get_data(node, "positions"))
+
+    def _save_amr_grids(self, storage, blocks, pos):
+        node = self._amr_storage_node
+        storage.save_data(blocks, node, "blocks", force=True)
+        storage.save_data(pos, node, "positions", force=True)
+        storage.save_data(self._amr_file_stat(), node, "amr_stat", force=True)
 
     def included(self, selector):
         if getattr(selector, "domain_id", None) is not None:
@@ -230,31 +296,77 @@ class RAMSESIndex(OctreeIndex):
         self.dataset = weakref.proxy(ds)
         self.index_filename = self.dataset.parameter_filename
         self.directory = os.path.dirname(self.index_filename)
-        self.max_level = None
 
         self.float_type = np.float64
         super(RAMSESIndex, self).__init__(ds, dataset_type)
 
+    _max_level = None
+
+    @property
+    def max_level(self):
+        if self._max_level is None and getattr(self, 'domains', None):
+            self._max_level = max(dom.max_level for dom in self.domains)
+        return self._max_level
+
+    @max_level.setter
+    def max_level(self, value):
+        self._max_level = value
+
     def _initialize_oct_handler(self):
-        if self.ds._bbox is not None:
+        # When the dataset is restricted to a bounding box, only read
+        # the AMR structure of each domain when it is first needed.
+        lazy = self.ds._bbox is not None
+        if lazy:
             cpu_list = get_cpu_list(self.dataset, self.dataset._bbox)
         else:
             cpu_list = range(self.dataset['ncpu'])
 
-        self.domains = [RAMSESDomainFile(self.dataset, i + 1)
+        # Cache the AMR structure in the data file, if there is one
+        storage = self if self._data_file is not None else None
+
+        # The headers are read serially, as the handlers set state
+        # shared by all the domains (e.g. only one domain counts the
+        # sinks). The AMR trees are read afterwards, unless deferred.
+        self.domains = [RAMSESDomainFile(self.dataset, i + 1, storage=storage,
+                                         lazy=True)
                         for i in cpu_list]
+
+        if not lazy:
+            # The AMR files are independent, so they can be read
+            # concurrently
+            nthreads = _get_num_io_threads(len(self.domains))
+            if nthreads > 1:
+                mylog.debug("Reading %s AMR files using %s threads",
+                            len(self.domains), nthreads)
+                pool = ThreadPool(nthreads)
+                try:
+                    pool.map(lambda dom: dom._read_amr(storage), self.domains)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for dom in self.domains:
+                    dom._read_amr(storage)
         total_octs = sum(dom.local_oct_count #+ dom.ngridbound.sum()
                          for dom in self.domains)
-        self.max_level = max(dom.max_level for dom in self.domains)
+        if not lazy:
+            self.max_level = max(dom.max_level for dom in self.domains)
         self.num_grids = total_octs
 
     def _detect_output_fields(self):
         dsl = set([])
 
-        # Get the detected particle fields
+        # Get the detected particle fields. The fields of a particle
+        # type are the same in all the domains whose file exists, so
+        # stop as soon as each type has been found once.
+        ptypes = set(self.ds.particle_types_raw)
         for domain in self.domains:
+            if not ptypes:
+                break
             for ph in domain.particle_handlers:
-                dsl.update(set(ph.field_offsets.keys()))
+                if ph.ptype in ptypes and ph.field_offsets:
+                    dsl.update(ph.field_offsets.keys())
+                    ptypes.discard(ph.ptype)
 
         self.particle_field_list = list(dsl)
         cosmo = self.ds.cosmological_simulation
@@ -301,18 +413,29 @@ class RAMSESIndex(OctreeIndex):
         for subset in oobjs:
             yield YTDataChunk(dobj, "io", [subset], None, cache = cache)
 
+    level_stats_numcells = None
+    level_stats_level = None
+
     def _initialize_level_stats(self):
+        FieldFileHandler.precompute_offsets(self.domains)
         levels=sum([dom.level_count for dom in self.domains])
-        desc = {'names': ['numcells','level'],
-                'formats':['Int64']*2}
         max_level=self.dataset.min_level+self.dataset.max_level+2
-        self.level_stats = blankRecordArray(desc, max_level)
-        self.level_stats['level'] = [i for i in range(max_level)]
-        self.level_stats['numcells'] = [0 for i in range(max_level)]
+        self.level_stats_level = np.arange(max_level, dtype='int64')
+        self.level_stats_numcells = np.zeros(max_level, dtype='int64')
         for level in range(self.dataset.min_level+1):
-            self.level_stats[level+1]['numcells']=2**(level*self.dataset.dimensionality)
-        for level in range(self.max_level+1):
-            self.level_stats[level+self.dataset.min_level+1]['numcells'] = levels[level]
+            self.level_stats_numcells[level+1] = 2**(level*self.dataset.dimensionality)
+        start = self.dataset.min_level+1
+        self.level_stats_numcells[start:start+self.max_level+1] = \
+            levels[:self.max_level+1]
+
+    @property
+    def level_stats(self):
+        """The number of cells per level, indexed by field name as for
+        the other indices."""
+        if self.level_stats_numcells is None:
+            self._initialize_level_stats()
+        return {'numcells': self.level_stats_numcells,
+                'level': self.level_stats_level}
 
     def _get_particle_type_counts(self):
         npart = 0
@@ -337,6 +460,7 @@ class RAMSESIndex(OctreeIndex):
             return
 
         self._initialize_level_stats()
+        numcells = self.level_stats_numcells
 
         header = "%3s\t%14s\t%14s" % ("level", "# cells","# cells^3")
         print(header)
@@ -344,10 +468,10 @@ class RAMSESIndex(OctreeIndex):
         for level in range(self.dataset.min_level+self.dataset.max_level+2):
             print("% 3i\t% 14i\t% 14i" % \
                   (level,
-                   self.level_stats['numcells'][level],
-                   np.ceil(self.level_stats['numcells'][level]**(1./3))))
+                   numcells[level],
+                   np.ceil(numcells[level]**(1./3))))
         print("-" * 46)
-        print("   \t% 14i" % (self.level_stats['numcells'].sum()))
+        print("   \t% 14i" % (numcells.sum()))
         print("\n")
 
         dx = self.get_smallest_dx()
@@ -393,6 +517,9 @@ class RAMSESDataset(Dataset):
         self.force_cosmological = cosmological
         self._bbox = bbox
 
+        # The output number, as in info_XXXXX.txt, used to find the files
+        self._iout = int(os.path.basename(filename).split(".")[0].split("_")[1])
+
         # Infer if the output is organized in groups
         root_folder, group_folder = os.path.split(os.path.split(filename)[0])
 
@@ -411,19 +538,30 @@ class RAMSESDataset(Dataset):
         Dataset.__init__(self, filename, dataset_type, units_override=units_override,
                          unit_system=unit_system)
 
-        # Add the particle types
-        ptypes = []
-        for PH in get_particle_handlers():
-            if PH.any_exist(self):
-                ptypes.append(PH.ptype)
+        # The absolute paths used to locate the files of every domain
+        self._output_dir = os.path.abspath(
+            os.path.dirname(self.parameter_filename))
+        self._abs_root_folder = os.path.abspath(self.root_folder)
 
-        ptypes = tuple(ptypes)
+        # The files may have been written since the last dataset was
+        # loaded, list the directories again
+        _list_directory.cache_clear()
+
+        # Add the particle types. The handlers found here are shared
+        # by all the domains, so that each domain does not have to
+        # look for the files again.
+        self._active_particle_handlers = [
+            PH for PH in get_particle_handlers() if PH.any_exist(self)]
+
+        ptypes = tuple(PH.ptype for PH in self._active_particle_handlers)
         self.particle_types = self.particle_types_raw = ptypes
 
         # Add the fluid types
+        self._active_field_handlers = []
         for FH in get_field_handlers():
             FH.purge_detected_fields(self)
             if FH.any_exist(self):
+                self._active_field_handlers.append(FH)
                 self.fluid_types += (FH.ftype, )
 
         self.storage_filename = storage_filename
@@ -568,14 +706,14 @@ class RAMSESDataset(Dataset):
             self.current_time = self.parameters['time']
         else :
             self.tau_frw, self.t_frw, self.dtau, self.n_frw, self.time_tot = \
-                friedman( self.omega_matter, self.omega_lambda, 1. - self.omega_matter - self.omega_lambda )
+                _cached_friedman( self.omega_matter, self.omega_lambda, 1. - self.omega_matter - self.omega_lambda )
 
+            # Linearly interpolate the time from the lookup table. The
+            # conformal time is decreasing, so reverse the table.
             age = self.parameters['time']
-            iage = 1 + int(10.*age/self.dtau)
-            iage = np.min([iage,self.n_frw//2 + (iage - self.n_frw//2)//10])
-
-            self.time_simu = self.t_frw[iage  ]*(age-self.tau_frw[iage-1])/(self.tau_frw[iage]-self.tau_frw[iage-1])+ \
-                             self.t_frw[iage-1]*(age-self.tau_frw[iage  ])/(self.tau_frw[iage-1]-self.tau_frw[iage])
+            ntab = self.n_frw + 1
+            self.time_simu = np.interp(age, self.tau_frw[ntab-1::-1],
+                                       self.t_frw[ntab-1::-1])
 
             self.current_time = (self.time_tot + self.time_simu)/(self.hubble_constant*1e7/3.08e24)/self.parameters['unit_t']
 
@@ -585,5 +723,13 @@ class RAMSESDataset(Dataset):
     @classmethod
     def _is_valid(self, *args, **kwargs):
         if not os.path.basename(args[0]).startswith("info_"): return False
+        # Only successful checks are remembered, so that an output
+        # written after a failed attempt can still be loaded. They are
+        # keyed by absolute path, as relative ones depend on the
+        # working directory.
+        key = os.path.abspath(args[0])
+        if key in VALID_OUTPUTS: return True
         fn = args[0].replace("info_", "amr_").replace(".txt", ".out00001")
-        return os.path.exists(fn)
+        if not os.path.exists(fn): return False
+        VALID_OUTPUTS.add(key)
+        return True
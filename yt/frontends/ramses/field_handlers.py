@@ -1,28 +1,71 @@
 import os
+import numpy as np
+from multiprocessing.pool import ThreadPool
 from yt.utilities.cython_fortran_utils import FortranFile
-import glob
 from yt.extern.six import add_metaclass, PY2
 from yt.funcs import mylog
 from yt.config import ytcfg
 
-from .io import _read_fluid_file_descriptor
+from .io import _read_fluid_file_descriptor, _file_exists, \
+    _get_num_io_threads
 from .io_utils import read_offset
 
 
 if PY2:
     FileNotFoundError = IOError
+else:
+    from sys import intern
 
+# Sizes (in bytes) of the Fortran records: each one is surrounded by
+# two int32 markers holding its length
+INT32_SIZE = np.dtype(np.int32).itemsize
+DOUBLE_SIZE = np.dtype(np.float64).itemsize
+INT_RECORD_SIZE = 3 * INT32_SIZE
 
-FIELD_HANDLERS = set()
+
+# The handlers, in order of registration
+FIELD_HANDLERS = []
+_FIELD_HANDLERS_SET = set()
 
 def get_field_handlers():
-    return FIELD_HANDLERS
+    return tuple(FIELD_HANDLERS)
 
 def register_field_handler(ph):
-    FIELD_HANDLERS.add(ph)
+    if ph in _FIELD_HANDLERS_SET:
+        return
+    _FIELD_HANDLERS_SET.add(ph)
+    FIELD_HANDLERS.append(ph)
 
 PRESENT_FIELD_FILES = {}
 DETECTED_FIELDS = {}
+RT_PARAMETERS = {}
+FIELD_LISTS = {}
+
+def get_field_list(ftype, fields):
+    '''
+    Return the (ftype, field) tuples of the fields. Datasets with the
+    same fields share the same (interned) tuples.
+    '''
+    key = (ftype, tuple(fields))
+    if key not in FIELD_LISTS:
+        FIELD_LISTS[key] = tuple((ftype, intern(str(e))) for e in fields)
+    return FIELD_LISTS[key]
+
+# Default hydro fields, by (RT run, number of variables), used when
+# the fields can neither be read from a descriptor nor from the config
+_HYDRO = ("Density", "x-velocity", "y-velocity", "z-velocity")
+_BFIELDS = ("x-Bfield-left", "y-Bfield-left", "z-Bfield-left",
+            "x-Bfield-right", "y-Bfield-right", "z-Bfield-right")
+HYDRO_FIELDS = {
+    (False, 5): _HYDRO + ("Pressure", ),
+    (False, 6): _HYDRO + ("Pressure", "Metallicity"),
+    (False, 11): _HYDRO + _BFIELDS + ("Pressure", ),
+    (False, 12): _HYDRO + _BFIELDS + ("Pressure", "Metallicity"),
+    # RAMSES-RT runs, without and with IR trapping
+    (True, 9): _HYDRO + ("Pressure", "Metallicity", "HII", "HeII", "HeIII"),
+    (True, 10): _HYDRO + ("Pres_IR", "Pressure", "Metallicity",
+                          "HII", "HeII", "HeIII"),
+}
 
 class RAMSESFieldFileHandlerRegistry(type):
     """
@@ -71,12 +114,8 @@ class FieldFileHandler(object):
         self.domain = domain
         self.domain_id = domain.domain_id
         ds = domain.ds
-        basename = os.path.abspath(
-              ds.root_folder)
-        iout = int(
-            os.path.basename(ds.parameter_filename)
-            .split(".")[0].
-            split("_")[1])
+        basename = ds._abs_root_folder
+        iout = ds._iout
 
         if ds.num_groups > 0:
             igroup = ((domain.domain_id-1) // ds.group_size) + 1
@@ -89,7 +128,7 @@ class FieldFileHandler(object):
                 basename,
                 self.fname.format(iout=iout, icpu=domain.domain_id))
 
-        if os.path.exists(full_path):
+        if _file_exists(full_path):
             self.fname = full_path
         else:
             raise FileNotFoundError(
@@ -111,7 +150,7 @@ class FieldFileHandler(object):
         By default, it just returns whether the file exists. Override
         it for more complex cases.
         '''
-        return os.path.exists(self.fname)
+        return _file_exists(self.fname)
 
     @property
     def has_part_descriptor(self):
@@ -145,15 +184,12 @@ class FieldFileHandler(object):
         if (ds.unique_identifier, cls.ftype) in PRESENT_FIELD_FILES:
             return PRESENT_FIELD_FILES[(ds.unique_identifier, cls.ftype)]
 
-        iout = int(
-            os.path.basename(ds.parameter_filename)
-            .split(".")[0]
-            .split("_")[1])
+        iout = ds._iout
 
         fname = os.path.join(
             os.path.split(ds.parameter_filename)[0],
             cls.fname.format(iout=iout, icpu=1))
-        exists = os.path.exists(fname)
+        exists = _file_exists(fname)
         PRESENT_FIELD_FILES[(ds.unique_identifier, cls.ftype)] = exists
 
         return exists
@@ -167,7 +203,7 @@ class FieldFileHandler(object):
         * parameters: dictionary
            Dictionary containing the variables. The keys should match
            those of `cls.attrs`
-        * field_list: list of (ftype, fname)
+        * field_list: tuple of (ftype, fname), see `get_field_list`
            The list of the field present in the file
         '''
         # this function must be implemented by subclasses
@@ -208,6 +244,7 @@ class FieldFileHandler(object):
         '''
         if ds.unique_identifier in DETECTED_FIELDS:
             DETECTED_FIELDS.pop(ds.unique_identifier)
+        RT_PARAMETERS.pop(ds.unique_identifier, None)
 
     @property
     def level_count(self):
@@ -242,14 +279,85 @@ class FieldFileHandler(object):
             fd.skip(nskip)
             min_level = self.domain.ds.min_level
 
-            offset, level_count = read_offset(
-                fd, min_level, self.domain.domain_id, self.parameters['nvar'],
-                self.domain.amr_header)
+            res = self._compute_offset(fd.tell())
+            if res is None:
+                res = read_offset(
+                    fd, min_level, self.domain.domain_id,
+                    self.parameters['nvar'], self.domain.amr_header)
+            offset, level_count = res
 
         self._offset = offset
         self._level_count = level_count
         return self._offset
 
+    def _compute_offset(self, header_size):
+        '''
+        Compute the offsets from the number of grids of each
+        (level, cpu) block given in the AMR file, without reading the
+        fluid file. Returns None if the file does not have the
+        expected size, in which case it has to be scanned.
+        '''
+        domain = self.domain
+        amr_header = domain.amr_header
+        nlevelmax = amr_header['nlevelmax']
+        ncpu = amr_header['ncpu']
+        nboundary = amr_header['nboundary']
+        min_level = domain.ds.min_level
+
+        ncache = np.empty((nlevelmax, ncpu + nboundary), dtype=np.int64)
+        ncache[:, :ncpu] = amr_header['numbl']
+        if nboundary > 0:
+            ncache[:, ncpu:] = domain.ngridbound.reshape(nlevelmax, nboundary)
+
+        # Each block holds the level and ncache records, followed by
+        # 2**ndim * nvar records of ncache doubles if it isn't empty
+        nrecords = 2**amr_header['ndim'] * self.parameters['nvar']
+        block_header_size = 2 * INT_RECORD_SIZE
+        record_size = ncache * DOUBLE_SIZE + 2 * INT32_SIZE
+        block_size = block_header_size + np.where(
+            ncache > 0, nrecords * record_size, 0)
+        block_end = header_size + np.cumsum(block_size.ravel()).reshape(
+            block_size.shape)
+
+        if block_end[-1, -1] != os.path.getsize(self.fname):
+            return None
+
+        icpu = domain.domain_id - 1
+        level_count = ncache[min_level:, icpu].copy()
+        data_start = block_end - block_size + block_header_size
+        offset = np.where(level_count > 0, data_start[min_level:, icpu], -1)
+
+        return offset, level_count
+
+    @classmethod
+    def precompute_offsets(cls, domains, ftypes=None):
+        '''
+        Compute the offsets of the files of all the domains at once.
+
+        The files are independent, so they are scanned concurrently, to
+        keep several reads in flight. Only the handlers of this class
+        (and of the field types in *ftypes*, if given) are considered.
+        '''
+        handlers = [fh for dom in domains for fh in dom.field_handlers
+                    if isinstance(fh, cls)
+                    and (ftypes is None or fh.ftype in ftypes)
+                    and getattr(fh, '_offset', None) is None]
+
+        nthreads = _get_num_io_threads(len(handlers))
+        if len(handlers) < 8 or nthreads < 2:
+            for fh in handlers:
+                fh.offset
+            return
+
+        mylog.debug("Computing the offsets of %s files using %s threads",
+                    len(handlers), nthreads)
+        pool = ThreadPool(nthreads)
+        try:
+            pool.map(lambda fh: fh.offset, handlers)
+        finally:
+            pool.close()
+            pool.join()
+
 
 class HydroFieldFileHandler(FieldFileHandler):
     ftype = 'ramses'
@@ -316,45 +424,32 @@ class HydroFieldFileHandler(FieldFileHandler):
 
         # Else, attempt autodetection
         if not ok:
-            foldername  = os.path.abspath(os.path.dirname(ds.parameter_filename))
-            rt_flag = any(glob.glob(os.sep.join([foldername, 'info_rt_*.txt'])))
+            # Look for the RT info file of this output directly rather
+            # than listing the whole directory
+            rt_flag = os.path.exists(
+                ds.parameter_filename.replace('info_', 'info_rt_'))
             if rt_flag: # rt run
                 if nvar < 10:
                     mylog.info('Detected RAMSES-RT file WITHOUT IR trapping.')
-
-                    fields = ["Density", "x-velocity", "y-velocity", "z-velocity", "Pressure",
-                              "Metallicity", "HII", "HeII", "HeIII"]
+                    key = (True, 9)
                 else:
                     mylog.info('Detected RAMSES-RT file WITH IR trapping.')
-
-                    fields = ["Density", "x-velocity", "y-velocity", "z-velocity", "Pres_IR",
-                              "Pressure", "Metallicity", "HII", "HeII", "HeIII"]
+                    key = (True, 10)
             else:
                 if nvar < 5:
                     mylog.debug("nvar=%s is too small! YT doesn't currently support 1D/2D runs in RAMSES %s")
                     raise ValueError
                 # Basic hydro runs
                 if nvar == 5:
-                    fields = ["Density",
-                              "x-velocity", "y-velocity", "z-velocity",
-                              "Pressure"]
-                if nvar > 5 and nvar < 11:
-                    fields = ["Density",
-                              "x-velocity", "y-velocity", "z-velocity",
-                              "Pressure", "Metallicity"]
+                    key = (False, 5)
+                elif nvar < 11:
+                    key = (False, 6)
                 # MHD runs - NOTE: THE MHD MODULE WILL SILENTLY ADD 3 TO THE NVAR IN THE MAKEFILE
-                if nvar == 11:
-                    fields = ["Density",
-                              "x-velocity", "y-velocity", "z-velocity",
-                              "x-Bfield-left", "y-Bfield-left", "z-Bfield-left",
-                              "x-Bfield-right", "y-Bfield-right", "z-Bfield-right",
-                              "Pressure"]
-                if nvar > 11:
-                    fields = ["Density",
-                              "x-velocity", "y-velocity", "z-velocity",
-                              "x-Bfield-left", "y-Bfield-left", "z-Bfield-left",
-                              "x-Bfield-right", "y-Bfield-right", "z-Bfield-right",
-                              "Pressure", "Metallicity"]
+                elif nvar == 11:
+                    key = (False, 11)
+                else:
+                    key = (False, 12)
+            fields = list(HYDRO_FIELDS[key])
             mylog.debug("No fields specified by user; automatically setting fields array to %s"
                         % str(fields))
 
@@ -365,7 +460,7 @@ class HydroFieldFileHandler(FieldFileHandler):
             count_extra += 1
         if count_extra > 0:
             mylog.debug('Detected %s extra fluid fields.' % count_extra)
-        cls.field_list = [(cls.ftype, e) for e in fields]
+        cls.field_list = get_field_list(cls.ftype, fields)
 
         cls.set_detected_fields(ds, fields)
 
@@ -384,8 +479,13 @@ class GravFieldFileHandler(FieldFileHandler):
 
     @classmethod
     def detect_fields(cls, ds):
+        # Try to get the detected fields
+        detected_fields = cls.get_detected_fields(ds)
+        if detected_fields:
+            return detected_fields
+
         ndim = ds.dimensionality
-        iout = int(str(ds).split('_')[1])
+        iout = ds._iout
         basedir = os.path.split(ds.parameter_filename)[0]
         fname = os.path.join(basedir, cls.fname.format(iout=iout, icpu=1))
         with FortranFile(fname) as fd:
@@ -396,7 +496,7 @@ class GravFieldFileHandler(FieldFileHandler):
 
         if nvar == ndim + 1:
             fields = ['potential'] + ['%s-acceleration' % k for k in 'xyz'[:ndim]]
-            ndetected = ndim
+            ndetected = ndim + 1
         else:
             fields = ['%s-acceleration' % k for k in 'xyz'[:ndim]]
             ndetected = ndim
@@ -406,11 +506,12 @@ class GravFieldFileHandler(FieldFileHandler):
                           nvar-ndetected)
             ds._warned_extra_fields['gravity'] = True
 
-            for i in range(nvar-ndetected):
-                fields.append('var%s' % i)
+        for i in range(nvar-ndetected):
+            fields.append('var%s' % i)
 
-        cls.field_list = [(cls.ftype, e) for e in fields]
+        cls.field_list = get_field_list(cls.ftype, fields)
 
+        cls.set_detected_fields(ds, fields)
         return fields
 
 
@@ -428,12 +529,15 @@ class RTFieldFileHandler(FieldFileHandler):
     )
 
     @classmethod
-    def detect_fields(cls, ds):
-        # Try to get the detected fields
-        detected_fields = cls.get_detected_fields(ds)
-        if detected_fields:
-            return detected_fields
+    def read_rt_header(cls, ds):
+        '''
+        Read the RT parameters from the info_rt file of the dataset.
 
+        The file is only parsed once per dataset, the result is then
+        taken from the registry, which is purged on dataset creation.
+        '''
+        if ds.unique_identifier in RT_PARAMETERS:
+            return RT_PARAMETERS[ds.unique_identifier]
 
         fname = ds.parameter_filename.replace('info_', 'info_rt_')
 
@@ -471,11 +575,22 @@ class RTFieldFileHandler(FieldFileHandler):
             # Touchy part, we have to read the photon group properties
             mylog.debug('Not reading photon group properties')
 
-            cls.rt_parameters = rheader
+        RT_PARAMETERS[ds.unique_identifier] = rheader
+        return rheader
+
+    @classmethod
+    def detect_fields(cls, ds):
+        # Try to get the detected fields
+        detected_fields = cls.get_detected_fields(ds)
+        if detected_fields:
+            return detected_fields
+
+        rheader = cls.read_rt_header(ds)
+        cls.rt_parameters = rheader
 
         ngroups = rheader['nGroups']
 
-        iout = int(str(ds).split('_')[1])
+        iout = ds._iout
         basedir = os.path.split(ds.parameter_filename)[0]
         fname = os.path.join(basedir, cls.fname.format(iout=iout, icpu=1))
         with FortranFile(fname) as fd:
@@ -486,15 +601,11 @@ class RTFieldFileHandler(FieldFileHandler):
             tmp = ["Photon_density_%s", "Photon_flux_x_%s", "Photon_flux_y_%s", "Photon_flux_z_%s"]
             fields.extend([t % (ng + 1) for t in tmp])
 
-        cls.field_list = [(cls.ftype, e) for e in fields]
+        cls.field_list = get_field_list(cls.ftype, fields)
 
         cls.set_detected_fields(ds, fields)
         return fields
 
     @classmethod
     def get_rt_parameters(cls, ds):
-        if cls.rt_parameters: return cls.rt_parameters
-
-        # Call detect fields to get the rt_parameters
-        cls.detect_fields(ds)
-        return cls.rt_parameters
+        return cls.read_rt_header(ds)
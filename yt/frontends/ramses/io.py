@@ -14,39 +14,64 @@ RAMSES-specific IO
 #-----------------------------------------------------------------------------
 
 from collections import defaultdict
+import os
 import numpy as np
 
 from yt.utilities.io_handler import \
     BaseIOHandler
+from yt.config import ytcfg
 from yt.utilities.logger import ytLogger as mylog
+from yt.utilities.lru_cache import lru_cache
 from yt.utilities.physical_ratios import cm_per_km, cm_per_mpc
 from yt.utilities.cython_fortran_utils import FortranFile
 from yt.utilities.exceptions import YTFieldTypeNotFound, YTParticleOutputFormatNotImplemented, \
     YTFileNotParseable
 import re
 
+# Patterns of the particle and fluid file descriptors
+VERSION_RE = re.compile(r'# version: *(\d+)')
+VAR_DESC_RE = re.compile(r'\s*(\d+),\s*(\w+),\s*(\w+)')
+
+@lru_cache(maxsize=128)
+def _list_directory(dirname):
+    try:
+        return frozenset(os.listdir(dirname))
+    except OSError:
+        return frozenset()
+
+def _file_exists(fname):
+    '''
+    Return whether fname exists, using a cached listing of its
+    directory. An output has thousands of files per directory, so
+    listing it once is much cheaper than a stat per file. The listings
+    are cleared each time a dataset is loaded.
+    '''
+    dirname, basename = os.path.split(fname)
+    return basename in _list_directory(dirname or os.curdir)
+
+def _get_num_io_threads(njobs):
+    '''
+    Return the number of threads used to read *njobs* independent
+    files. Reading is only threaded when the numthreads option is
+    explicitly set above 1; unlike `get_num_threads`, OMP_NUM_THREADS
+    is not used as a fallback.
+    '''
+    nthreads = ytcfg.getint("yt", "numthreads")
+    return max(1, min(nthreads, njobs))
+
 def convert_ramses_ages(ds, conformal_ages):
     tf = ds.t_frw
-    dtau = ds.dtau
     tauf = ds.tau_frw
     tsim = ds.time_simu
     h100 = ds.hubble_constant
-    nOver2 = ds.n_frw/2
+    ntab = ds.n_frw + 1
     unit_t = ds.parameters['unit_t']
     t_scale = 1./(h100 * 100 * cm_per_km / cm_per_mpc) / unit_t
 
-    # calculate index into lookup table (n_frw elements in
-    # lookup table)
-    dage =  1 + (10*conformal_ages/dtau)
-    dage = np.minimum(dage, nOver2 + (dage - nOver2)/10.)
-    iage = np.array(dage, dtype=np.int32)
-
     # linearly interpolate physical times from tf and tauf lookup
-    # tables.
-    t = ((tf[iage]*(conformal_ages - tauf[iage - 1]) /
-          (tauf[iage] - tauf[iage - 1])))
-    t = t + ((tf[iage-1]*(conformal_ages - tauf[iage]) /
-              (tauf[iage-1]-tauf[iage])))
+    # tables, the same way the simulation time is computed. The
+    # conformal time is decreasing, so reverse the tables.
+    t = np.interp(conformal_ages, tauf[ntab-1::-1], tf[ntab-1::-1])
     return (tsim - t)*t_scale
 
 
@@ -101,6 +126,13 @@ class IOHandlerRAMSES(BaseIOHandler):
 
         # Set of field types
         ftypes = set(f[0] for f in fields)
+
+        # Compute the offsets of all the files to read at once
+        from .field_handlers import FieldFileHandler
+        chunks = list(chunks)
+        domains = [subset.domain for chunk in chunks for subset in chunk.objs]
+        FieldFileHandler.precompute_offsets(domains, ftypes)
+
         for chunk in chunks:
             # Gather fields by type to minimize i/o operations
             for ft in ftypes:
@@ -213,8 +245,6 @@ def _read_part_file_descriptor(fname):
     """
     Read a file descriptor and returns the array of the fields found.
     """
-    VERSION_RE = re.compile(r'# version: *(\d+)')
-    VAR_DESC_RE = re.compile(r'\s*(\d+),\s*(\w+),\s*(\w+)')
 
     # Mapping
     mapping = [
@@ -246,7 +276,7 @@ def _read_part_file_descriptor(fname):
             # Skip one line (containing the headers)
             line = f.readline()
             fields = []
-            for i, line in enumerate(f.readlines()):
+            for i, line in enumerate(f):
                 tmp = VAR_DESC_RE.match(line)
                 if not tmp:
                     raise YTFileNotParseable(fname, i+1)
@@ -270,8 +300,6 @@ def _read_fluid_file_descriptor(fname):
     """
     Read a file descriptor and returns the array of the fields found.
     """
-    VERSION_RE = re.compile(r'# version: *(\d+)')
-    VAR_DESC_RE = re.compile(r'\s*(\d+),\s*(\w+),\s*(\w+)')
 
     # Mapping
     mapping = [
@@ -298,7 +326,7 @@ def _read_fluid_file_descriptor(fname):
             # Skip one line (containing the headers)
             line = f.readline()
             fields = []
-            for i, line in enumerate(f.readlines()):
+            for i, line in enumerate(f):
                 tmp = VAR_DESC_RE.match(line)
                 if not tmp:
                     raise YTFileNotParseable(fname, i+1)
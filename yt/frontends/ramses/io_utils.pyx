@@ -1,6 +1,7 @@
 cimport cython
 cimport numpy as np
 import numpy as np
+from libc.stdio cimport fread, SEEK_CUR
 from yt.utilities.cython_fortran_utils cimport FortranFile
 from yt.geometry.oct_container cimport RAMSESOctreeContainer
 from yt.utilities.exceptions import YTIllDefinedAMRData
@@ -13,28 +14,44 @@ ctypedef np.float64_t DOUBLE_t
 @cython.wraparound(False)
 @cython.cdivision(True)
 @cython.nonecheck(False)
-def read_amr(FortranFile f, dict headers,
-             np.ndarray[np.int64_t, ndim=1] ngridbound, INT64_t min_level,
-             RAMSESOctreeContainer oct_handler):
-
-    cdef INT64_t ncpu, nboundary, max_level, nlevelmax, ncpu_and_bound
-    cdef DOUBLE_t nx, ny, nz
-    cdef INT64_t ilevel, icpu, n, ndim, skip_len
-    cdef INT32_t ng, buffer_size
+def read_amr_grids(FortranFile f, dict headers,
+                   np.ndarray[np.int64_t, ndim=1] ngridbound):
+    """Read the position of all the grids in an AMR file.
+
+    The file is expected to be positioned at the beginning of the tree.
+
+    Returns
+    -------
+    blocks : (nblocks, 3) ndarray of int64
+        The cpu, level and number of grids of each (level, cpu) block
+    pos : (ngrids, 3) ndarray of float64
+        The positions of the grids, block after block
+    """
+
+    cdef INT64_t ncpu, nboundary, nlevelmax, ncpu_and_bound
+    cdef INT64_t ilevel, icpu, ndim, skip_len, idim, ig, iblock, igrid
+    cdef INT32_t ng
     cdef np.ndarray[np.int32_t, ndim=2] numbl
-    cdef np.ndarray[np.float64_t, ndim=2] pos
+    cdef np.ndarray[np.int64_t, ndim=2] blocks
+    cdef np.ndarray[np.float64_t, ndim=2] pos, xg
+    cdef np.ndarray[np.float64_t, ndim=1] offsets
 
     ndim = headers['ndim']
     numbl = headers['numbl']
     nboundary = headers['nboundary']
-    nx, ny, nz = (((i-1.0)/2.0) for i in headers['nx'])
+    # The grid positions are written with respect to the coarse grid
+    offsets = np.array([(i - 1.0) / 2.0 for i in headers['nx']], dtype=np.float64)
     nlevelmax = headers['nlevelmax']
     ncpu = headers['ncpu']
 
     ncpu_and_bound = nboundary + ncpu
 
-    pos = np.empty((0, 3), dtype=np.float64)
-    buffer_size = 0
+    blocks = np.empty((nlevelmax * ncpu_and_bound, 3), dtype=np.int64)
+    pos = np.empty((numbl.sum(dtype=np.int64) + ngridbound.sum(), 3),
+                   dtype=np.float64)
+    # Missing dimensions sit in the middle of the domain
+    pos[:, ndim:] = 0.5
+
     # Compute number of fields to skip. This should be 31 in 3 dimensions
     skip_len = (1          # father index
                 + 2*ndim   # neighbor index
@@ -42,8 +59,8 @@ def read_amr(FortranFile f, dict headers,
                 + 2**ndim  # cpu map
                 + 2**ndim  # refinement map
     )
-    # Initialize values
-    max_level = 0
+    iblock = 0
+    igrid = 0
     for ilevel in range(nlevelmax):
         for icpu in range(ncpu_and_bound):
             if icpu < ncpu:
@@ -57,25 +74,50 @@ def read_amr(FortranFile f, dict headers,
             # to build the linked list in RAMSES)
             f.skip(3)
 
-            # Allocate more memory if required
-            if ng > buffer_size:
-                pos = np.empty((ng, 3), dtype="d")
-                buffer_size = ng
-
-            pos[:ng, 0] = f.read_vector("d") - nx
-            pos[:ng, 1] = f.read_vector("d") - ny
-            pos[:ng, 2] = f.read_vector("d") - nz
+            # Read the ndim position records at once
+            xg = f.read_vectors("d", ndim)
+            if xg.shape[1] != ng:
+                raise YTIllDefinedAMRData(
+                    'Expected %s grid positions at level %s, got %s'
+                    % (ng, ilevel, xg.shape[1]))
+            for idim in range(ndim):
+                for ig in range(ng):
+                    pos[igrid + ig, idim] = xg[idim, ig] - offsets[idim]
 
             # Skip father, neighbor, son, cpu map and refinement map
             f.skip(skip_len)
-            # Note that we're adding *grids*, not individual cells.
-            if ilevel >= min_level:
-                n = oct_handler.add(icpu + 1, ilevel - min_level, pos[:ng, :],
-                                    count_boundary = 1)
-                if n > 0:
-                    max_level = max(ilevel - min_level, max_level)
 
-    return max_level
+            blocks[iblock, 0] = icpu
+            blocks[iblock, 1] = ilevel
+            blocks[iblock, 2] = ng
+            iblock += 1
+            igrid += ng
+
+    return blocks[:iblock], pos
+
+def add_amr_grids(RAMSESOctreeContainer oct_handler,
+                  np.ndarray[np.int64_t, ndim=2] blocks,
+                  np.ndarray[np.float64_t, ndim=2] pos,
+                  INT64_t min_level):
+    """Add the grids returned by `read_amr_grids` to the octree and
+    return the maximum level."""
+
+    cdef np.ndarray[np.int64_t, ndim=1] nadded, levels
+
+    # Grids coarser than the minimum level are not part of the octree
+    keep = blocks[:, 1] >= min_level
+    if not keep.all():
+        pos = pos[np.repeat(keep, blocks[:, 2])]
+        blocks = blocks[keep]
+
+    # Note that we're adding *grids*, not individual cells.
+    levels = blocks[:, 1] - min_level
+    nadded = oct_handler.add_bulk(blocks[:, 0] + 1, levels, blocks[:, 2],
+                                  pos, count_boundary = 1)
+
+    if not (nadded > 0).any():
+        return 0
+    return levels[nadded > 0].max()
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
@@ -87,6 +129,8 @@ cpdef read_offset(FortranFile f, INT64_t min_level, INT64_t domain_id, INT64_t n
     cdef INT64_t ndim, twotondim, nlevelmax, n_levels, nboundary, ncpu, ncpu_and_bound
     cdef INT64_t ilevel, icpu, skip_len
     cdef INT32_t file_ilevel, file_ncache
+    # The ilevel and ncache records, with their markers
+    cdef INT32_t block_header[6]
 
     numbl = headers['numbl']
     ndim = headers['ndim']
@@ -110,21 +154,33 @@ cpdef read_offset(FortranFile f, INT64_t min_level, INT64_t domain_id, INT64_t n
 
     for ilevel in range(nlevelmax):
         for icpu in range(ncpu_and_bound):
-            file_ilevel = f.read_int()
-            file_ncache = f.read_int()
+            # Read the two single-int records at once
+            if fread(block_header, sizeof(INT32_t), 6, f.cfile) != 6:
+                raise IOError('Unexpected end of file while reading offsets')
+            if (block_header[0] != sizeof(INT32_t) or block_header[2] != sizeof(INT32_t) or
+                block_header[3] != sizeof(INT32_t) or block_header[5] != sizeof(INT32_t)):
+                raise IOError('Sizes do not agree in the header and footer for '
+                              'this record - check header dtype')
+            file_ilevel = block_header[1]
+            file_ncache = block_header[4]
             if file_ncache == 0:
                 continue
 
+            # This is cheap here, so check every block
             if file_ilevel != ilevel+1:
                 raise YTIllDefinedAMRData(
-                    'Cannot read offsets in file %s. The level read '
-                    'from data (%s) is not coherent with the expected (%s)',
-                    f.name, file_ilevel, ilevel)
+                    'Cannot read offsets of domain %s. The level read '
+                    'from data (%s) is not coherent with the expected (%s)'
+                    % (domain_id, file_ilevel, ilevel+1))
 
             if icpu + 1 == domain_id and ilevel >= min_level:
                 offset[ilevel - min_level] = f.tell()
                 level_count[ilevel - min_level] = <INT64_t> file_ncache
-            f.skip(skip_len)
+            # All the records of the block hold ncache doubles, so jump
+            # over them at once instead of reading each record marker.
+            # The level check above catches any inconsistency.
+            f.seek(skip_len * (file_ncache * sizeof(DOUBLE_t) + 2 * sizeof(INT32_t)),
+                   SEEK_CUR)
 
     return offset, level_count
 
@@ -141,12 +197,13 @@ def fill_hydro(FortranFile f,
                INT64_t ndim, list all_fields, list fields,
                dict tr,
                RAMSESOctreeContainer oct_handler):
-    cdef INT64_t ilevel, ifield, nfields, noffset
-    cdef INT64_t offset
+    cdef INT64_t ilevel, ifield, nfields, noffset, icell, nrun
+    cdef INT64_t offset, nc, record_bytes
     cdef dict tmp
     cdef str field
-    cdef INT64_t twotondim, i
+    cdef INT64_t twotondim
     cdef np.ndarray[np.uint8_t, ndim=1] mask
+    cdef np.ndarray[np.float64_t, ndim=3] buff
 
     twotondim = 2**ndim
     nfields = len(all_fields)
@@ -154,6 +211,15 @@ def fill_hydro(FortranFile f,
 
     mask = np.array([(field in fields) for field in all_fields], dtype=np.uint8)
 
+    # Group the fields into runs of consecutive records that are either
+    # all read or all skipped, as [first field, number of fields, read]
+    runs = []
+    for ifield in range(nfields):
+        if ifield > 0 and mask[ifield] == mask[ifield-1]:
+            runs[len(runs)-1][1] += 1
+        else:
+            runs.append([ifield, 1, mask[ifield]])
+
     # Loop over levels
     for ilevel in range(noffset):
         offset = offsets[ilevel]
@@ -161,17 +227,30 @@ def fill_hydro(FortranFile f,
             continue
         f.seek(offset)
         nc = level_count[ilevel]
+
+        # The records are stored cell by cell, then field by field.
+        if len(runs) == 1 and mask[0]:
+            # All the fields are needed, read the whole level at once.
+            buff = f.read_vectors('d', twotondim * nfields).reshape(
+                twotondim, nfields, nc)
+        else:
+            # All the records of a level have the same size, so the
+            # unneeded ones can be jumped over without reading their
+            # headers.
+            record_bytes = nc * sizeof(DOUBLE_t) + 2 * sizeof(INT32_t)
+            buff = np.empty((twotondim, nfields, nc), dtype=np.float64)
+            for icell in range(twotondim):
+                for ifield, nrun, read in runs:
+                    if read:
+                        buff[icell, ifield:ifield+nrun, :] = f.read_vectors(
+                            'd', nrun)
+                    else:
+                        f.seek(nrun * record_bytes, 1)
+
+        # Temporary data container for io, these are (nc, twotondim) views
         tmp = {}
-        # Initalize temporary data container for io
-        for field in all_fields:
-            tmp[field] = np.empty((nc, twotondim), dtype="float64")
-
-        for i in range(twotondim):
-            # Read the selected fields
-            for ifield in range(nfields):
-                if not mask[ifield]:
-                    f.skip()
-                else:
-                    tmp[all_fields[ifield]][:, i] = f.read_vector('d') # i-th cell
+        for ifield in range(nfields):
+            if mask[ifield]:
+                tmp[all_fields[ifield]] = buff[:, ifield, :].T
 
         oct_handler.fill_level(ilevel, levels, cell_inds, file_inds, tr, tmp)
@@ -4,19 +4,24 @@ from yt.extern.six import add_metaclass, PY2
 from yt.funcs import mylog
 from yt.config import ytcfg
 
-from .io import _read_part_file_descriptor
+from .io import _read_part_file_descriptor, _file_exists
 
 if PY2:
     FileNotFoundError = IOError
 
-PARTICLE_HANDLERS = set()
+# The handlers, in order of registration
+PARTICLE_HANDLERS = []
+_PARTICLE_HANDLERS_SET = set()
 PRESENT_PART_FILES = {}
 
 def get_particle_handlers():
-    return PARTICLE_HANDLERS
+    return tuple(PARTICLE_HANDLERS)
 
 def register_particle_handler(ph):
-    PARTICLE_HANDLERS.add(ph)
+    if ph in _PARTICLE_HANDLERS_SET:
+        return
+    _PARTICLE_HANDLERS_SET.add(ph)
+    PARTICLE_HANDLERS.append(ph)
 
 
 class RAMSESParticleFileHandlerRegistry(type):
@@ -68,12 +73,8 @@ class ParticleFileHandler(object):
         self.ds = ds
         self.domain = domain
         self.domain_id = domain.domain_id
-        basename = os.path.abspath(
-              ds.root_folder)
-        iout = int(
-            os.path.basename(ds.parameter_filename)
-            .split(".")[0].
-            split("_")[1])
+        basename = ds._abs_root_folder
+        iout = ds._iout
 
         if ds.num_groups > 0:
             igroup = ((domain.domain_id-1) // ds.group_size) + 1
@@ -86,7 +87,7 @@ class ParticleFileHandler(object):
                 basename,
                 self.fname.format(iout=iout, icpu=domain.domain_id))
 
-        if os.path.exists(full_path):
+        if _file_exists(full_path):
             self.fname = full_path
         else:
             raise FileNotFoundError(
@@ -124,7 +125,7 @@ class ParticleFileHandler(object):
         By default, it just returns whether the file exists. Override
         it for more complex cases.
         '''
-        return os.path.exists(self.fname)
+        return _file_exists(self.fname)
 
     @property
     def has_part_descriptor(self):
@@ -157,15 +158,12 @@ class ParticleFileHandler(object):
         if (ds.unique_identifier, cls.ptype) in PRESENT_PART_FILES:
             return PRESENT_PART_FILES[(ds.unique_identifier, cls.ptype)]
 
-        iout = int(
-            os.path.basename(ds.parameter_filename)
-            .split(".")[0]
-            .split("_")[1])
+        iout = ds._iout
 
         fname = os.path.join(
             os.path.split(ds.parameter_filename)[0],
             cls.fname.format(iout=iout, icpu=1))
-        exists = os.path.exists(fname)
+        exists = _file_exists(fname)
         PRESENT_PART_FILES[(ds.unique_identifier, cls.ptype)] = exists
 
         return exists
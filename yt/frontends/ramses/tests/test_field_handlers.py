@@ -0,0 +1,135 @@
+"""
+Tests for the RAMSES fluid file handlers
+
+
+
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2018, yt Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from yt.testing import assert_equal
+from yt.utilities.cython_fortran_utils import FortranFile
+from yt.frontends.ramses.field_handlers import HydroFieldFileHandler
+from yt.frontends.ramses.io_utils import read_offset
+
+
+class _MockDataset(object):
+    min_level = 1
+
+
+class _MockDomain(object):
+    def __init__(self, domain_id, numbl, ngridbound, ndim):
+        nlevelmax, ncpu = numbl.shape
+        self.ds = _MockDataset()
+        self.domain_id = domain_id
+        self.ngridbound = ngridbound.ravel()
+        self.amr_header = dict(numbl=numbl, ncpu=ncpu, ndim=ndim,
+                               nlevelmax=nlevelmax,
+                               nboundary=ngridbound.shape[1])
+
+
+def _write_records(f, records):
+    for rec in records:
+        rec = np.asarray(rec)
+        size = np.array([rec.nbytes], dtype='int32')
+        f.write(size.tobytes())
+        f.write(rec.tobytes())
+        f.write(size.tobytes())
+
+
+def _write_hydro_file(fname, numbl, ngridbound, ndim, nvar):
+    nlevelmax, ncpu = numbl.shape
+    nboundary = ngridbound.shape[1]
+    ncache = np.concatenate([numbl, ngridbound], axis=1)
+    with open(fname, 'wb') as f:
+        _write_records(f, [np.array([v], dtype='int32') for v in
+                           (ncpu, nvar, ndim, nlevelmax, nboundary)])
+        _write_records(f, [np.array([1.4])])
+        for ilevel in range(nlevelmax):
+            for icpu in range(ncpu + nboundary):
+                nc = ncache[ilevel, icpu]
+                _write_records(f, [np.array([ilevel + 1], dtype='int32'),
+                                   np.array([nc], dtype='int32')])
+                if nc == 0:
+                    continue
+                _write_records(f, [np.random.random(nc)
+                                   for _ in range(2**ndim * nvar)])
+
+
+def _get_handler(fname, domain, nvar):
+    fh = HydroFieldFileHandler.__new__(HydroFieldFileHandler)
+    fh.fname = fname
+    fh.domain = domain
+    fh.parameters = {'nvar': nvar}
+    return fh
+
+
+def _scan_offset(fh):
+    with FortranFile(fh.fname) as fd:
+        fd.skip(len(fh.attrs))
+        return read_offset(fd, fh.domain.ds.min_level, fh.domain.domain_id,
+                           fh.parameters['nvar'], fh.domain.amr_header)
+
+
+def test_compute_offset():
+    tmpdir = tempfile.mkdtemp()
+    fname = os.path.join(tmpdir, 'hydro_00001.out00002')
+    ndim, nvar = 3, 5
+    numbl = np.array([[1, 0, 0], [3, 4, 1], [0, 2, 7], [5, 0, 0]],
+                     dtype='int32')
+    ngridbound = np.array([[0], [2], [1], [0]], dtype='int64')
+    try:
+        _write_hydro_file(fname, numbl, ngridbound, ndim, nvar)
+        domain = _MockDomain(2, numbl, ngridbound, ndim)
+
+        fh = _get_handler(fname, domain, nvar)
+        with FortranFile(fname) as fd:
+            fd.skip(len(fh.attrs))
+            computed = fh._compute_offset(fd.tell())
+        expected = _scan_offset(fh)
+        assert computed is not None
+        for res, ref in zip(computed, expected):
+            assert_equal(res, ref)
+            assert_equal(res.dtype, ref.dtype)
+
+        assert_equal(fh.offset, expected[0])
+        assert_equal(fh.level_count, expected[1])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_compute_offset_size_mismatch():
+    tmpdir = tempfile.mkdtemp()
+    fname = os.path.join(tmpdir, 'hydro_00001.out00001')
+    ndim, nvar = 3, 2
+    numbl = np.array([[1, 0], [3, 4], [2, 0]], dtype='int32')
+    ngridbound = np.zeros((3, 0), dtype='int64')
+    try:
+        _write_hydro_file(fname, numbl, ngridbound, ndim, nvar)
+        # Trailing data the AMR header doesn't account for
+        with open(fname, 'ab') as f:
+            _write_records(f, [np.zeros(3)])
+        domain = _MockDomain(1, numbl, ngridbound, ndim)
+
+        # The offsets cannot be computed, so the file is scanned
+        fh = _get_handler(fname, domain, nvar)
+        with FortranFile(fname) as fd:
+            fd.skip(len(fh.attrs))
+            assert fh._compute_offset(fd.tell()) is None
+        expected = _scan_offset(fh)
+        assert_equal(fh.offset, expected[0])
+        assert_equal(fh.level_count, expected[1])
+    finally:
+        shutil.rmtree(tmpdir)
@@ -26,8 +26,13 @@ from yt.utilities.answer_testing.framework import \
     create_obj
 from yt.frontends.ramses.api import RAMSESDataset
 from yt.config import ytcfg
-from yt.frontends.ramses.field_handlers import DETECTED_FIELDS, HydroFieldFileHandler
+from yt.frontends.ramses.field_handlers import DETECTED_FIELDS, HydroFieldFileHandler, \
+    GravFieldFileHandler
+from yt.utilities.cython_fortran_utils import FortranFile
+from yt.frontends.ramses.io import convert_ramses_ages
 import os
+import shutil
+import tempfile
 import yt
 import numpy as np
 
@@ -244,6 +249,20 @@ def test_ramses_part_count():
     assert_equal(pcount['io'], 17132, err_msg='Got wrong number of io particle')
     assert_equal(pcount['sink'], 8, err_msg='Got wrong number of sink particle')
 
+@requires_file(ramses_sink)
+def test_ramses_part_count_threaded():
+    # Reading the AMR files concurrently doesn't change the counts
+    numthreads = ytcfg.get('yt', 'numthreads')
+    ytcfg['yt', 'numthreads'] = '4'
+    try:
+        ds = yt.load(ramses_sink)
+        pcount = ds.particle_type_counts
+    finally:
+        ytcfg['yt', 'numthreads'] = numthreads
+
+    assert_equal(pcount['io'], 17132, err_msg='Got wrong number of io particle')
+    assert_equal(pcount['sink'], 8, err_msg='Got wrong number of sink particle')
+
 @requires_file(ramsesCosmo)
 def test_custom_particle_def():
     ytcfg.add_section('ramses-particles')
@@ -298,6 +317,22 @@ def test_custom_hydro_def():
     finally:
         ytcfg.remove_section('ramses-hydro')
 
+@requires_file(output_00080)
+def test_bbox():
+    bbox = [[0.27747276, 0.30018937, 0.17916189],
+            [0.42656026, 0.40509483, 0.29927838]]
+    ds = yt.load(output_00080, bbox=bbox)
+
+    # The AMR trees are only read when needed
+    assert ('ramses', 'Density') in ds.field_list
+    assert all(dom._oct_handler is None for dom in ds.index.domains)
+
+    ds_all = yt.load(output_00080)
+    reg = ds.box(bbox[0], bbox[1])
+    reg_all = ds_all.box(bbox[0], bbox[1])
+    for field in (('index', 'ones'), ('gas', 'density')):
+        assert_equal(np.sort(reg[field]), np.sort(reg_all[field]))
+
 @requires_file(output_00080)
 def test_grav_detection():
     ds = yt.load(output_00080)
@@ -311,6 +346,16 @@ def test_grav_detection():
     for k in 'xyz':
         ds.r['gas', 'acceleration_%s' % k]
 
+    # The potential isn't detected as an extra field
+    fh, = [fh for fh in ds.index.domains[0].field_handlers
+           if fh.ftype == 'gravity']
+    with FortranFile(fh.fname) as fd:
+        nvar = fd.read_attrs(GravFieldFileHandler.attrs)['nvar']
+    if nvar == ds.dimensionality + 1:
+        assert ('gravity', 'potential') in ds.field_list
+        for ftype, fname in ds.field_list:
+            assert not (ftype == 'gravity' and fname.startswith('var'))
+
 @requires_file(ramses_sink)
 @requires_file(output_00080)
 def test_ramses_field_detection():
@@ -426,3 +471,54 @@ def test_ramses_mixed_files():
 
     # Access the field
     ds.r[('gas', 'mixed_files')]
+
+
+@requires_file(ramsesCosmo)
+def test_ramses_ages_at_current_time():
+    # The ages and the simulation time are interpolated from the same
+    # table, so a star born at the time of the output has a zero age
+    ds = yt.load(ramsesCosmo)
+    age = convert_ramses_ages(ds, np.array([ds.parameters['time']]))
+    assert_equal(age, 0)
+
+
+@requires_file(output_00080)
+def test_amr_cache():
+    # The AMR structure is saved in the index data file, read back on
+    # the next loads, and rebuilt once the AMR files have changed
+    src = os.path.dirname(yt.load(output_00080).parameter_filename)
+    tmpdir = tempfile.mkdtemp()
+    fn = os.path.join(tmpdir, 'output_00080', 'info_00080.txt')
+    serialize = ytcfg.get('yt', 'serialize')
+    ytcfg['yt', 'serialize'] = 'True'
+
+    def load():
+        ds = yt.load(fn)
+        ad = ds.all_data()
+        return ds, (ds.index.num_grids, ds.index.max_level,
+                    ad['gas', 'density'])
+
+    def check(res, ref):
+        for r1, r2 in zip(res, ref):
+            assert_equal(r1, r2)
+
+    try:
+        shutil.copytree(src, os.path.dirname(fn))
+        ds, ref = load()
+
+        ds, res = load()
+        dom = ds.index.domains[0]
+        assert dom._load_amr_grids(ds.index) is not None
+        check(res, ref)
+
+        # Touch the AMR file, the cached structure is not valid anymore
+        st = os.stat(dom.amr_fn)
+        os.utime(dom.amr_fn, (st.st_atime, st.st_mtime + 10))
+        assert dom._load_amr_grids(ds.index) is None
+
+        ds, res = load()
+        assert ds.index.domains[0]._load_amr_grids(ds.index) is not None
+        check(res, ref)
+    finally:
+        ytcfg['yt', 'serialize'] = serialize
+        shutil.rmtree(tmpdir)
@@ -86,6 +86,10 @@ cdef class OctreeContainer:
                         int vc = ?)
     cdef Oct *next_root(self, int domain_id, int ind[3])
     cdef Oct *next_child(self, int domain_id, int ind[3], Oct *parent)
+    cdef np.int64_t add_octs(self, int curdom, int curlevel,
+                             np.float64_t[:, :] pos,
+                             int skip_boundary,
+                             int count_boundary) except -1
     cdef void append_domain(self, np.int64_t domain_count)
     # The fill_style is the ordering, C or F, of the octs in the file.  "o"
     # corresponds to C, and "r" is for Fortran.
@@ -570,13 +570,20 @@ cdef class OctreeContainer:
         self.visit_all_octs(selector, visitor)
         return ind
 
-    @cython.boundscheck(False)
-    @cython.wraparound(False)
-    @cython.cdivision(True)
     def add(self, int curdom, int curlevel,
             np.ndarray[np.float64_t, ndim=2] pos,
             int skip_boundary = 1,
             int count_boundary = 0):
+        return self.add_octs(curdom, curlevel, pos, skip_boundary,
+                             count_boundary)
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    @cython.cdivision(True)
+    cdef np.int64_t add_octs(self, int curdom, int curlevel,
+                             np.float64_t[:, :] pos,
+                             int skip_boundary,
+                             int count_boundary) except -1:
         cdef int level, no, p, i, j, k
         cdef int ind[3]
         cdef int nb = 0
@@ -889,7 +896,37 @@ cdef class SparseOctreeContainer(OctreeContainer):
         if self.root_nodes != NULL: free(self.root_nodes)
 
 cdef class RAMSESOctreeContainer(SparseOctreeContainer):
-    pass
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def add_bulk(self, np.int64_t[:] domains, np.int64_t[:] levels,
+                 np.int64_t[:] counts, np.float64_t[:, :] pos,
+                 int skip_boundary = 1,
+                 int count_boundary = 0):
+        """Add several blocks of octs at once.
+
+        The i-th block is made of the counts[i] octs that follow the
+        octs of the previous blocks in *pos*; they are added as with
+        `add`, on domain domains[i] at level levels[i].
+
+        Returns the number of octs added for each block.
+        """
+        cdef np.int64_t i, start, nblocks
+        cdef np.ndarray[np.int64_t, ndim=1] nadded
+        nblocks = counts.shape[0]
+        if domains.shape[0] != nblocks or levels.shape[0] != nblocks:
+            raise ValueError("domains, levels and counts must have the same length")
+        if np.sum(counts) != pos.shape[0]:
+            raise ValueError("The counts (%s) do not match the number of positions (%s)"
+                             % (np.sum(counts), pos.shape[0]))
+        nadded = np.zeros(nblocks, dtype="int64")
+        start = 0
+        for i in range(nblocks):
+            nadded[i] = self.add_octs(domains[i], levels[i],
+                                      pos[start:start + counts[i], :],
+                                      skip_boundary, count_boundary)
+            start += counts[i]
+        return nadded
 
 cdef class ARTOctreeContainer(OctreeContainer):
     def __init__(self, oct_domain_dimensions, domain_left_edge,
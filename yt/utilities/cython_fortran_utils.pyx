@@ -2,10 +2,12 @@ cimport numpy as np
 import numpy as np
 import cython
 from libc.stdio cimport *
+from libc.errno cimport errno
+import os
 import struct
 
-cdef INT32_SIZE = sizeof(np.int32_t)
-cdef DOUBLE_SIZE = sizeof(np.float64_t)
+cdef INT64_t INT32_SIZE = sizeof(np.int32_t)
+cdef INT64_t DOUBLE_SIZE = sizeof(np.float64_t)
 
 cdef class FortranFile:
     """This class provides facilities to interact with files written
@@ -23,10 +25,30 @@ cdef class FortranFile:
 
     This module has been inspired by scipy's FortranFile, especially
     the docstrings.
+
+    Parameters
+    ----------
+    fname : str
+        The name of the file to open
+    buffer_size : int, optional
+        If positive, the size (in bytes) of the read buffer. Large
+        buffers amortize the cost of reading files made of many small
+        records sequentially. Defaults to the system's buffer size.
     """
-    def __cinit__(self, str fname):
-        self.cfile = fopen(fname.encode('utf-8'), 'r')
+    def __cinit__(self, str fname, INT64_t buffer_size=-1):
+        cdef bytes bname = fname.encode('utf-8')
+        cdef char* cname = bname
+        # Opening a file can be slow on network filesystems, let other
+        # threads run meanwhile
+        with nogil:
+            self.cfile = fopen(cname, 'r')
+        if self.cfile == NULL:
+            # Nothing to close in __dealloc__
+            self._closed = True
+            raise IOError(errno, os.strerror(errno), fname)
         self._closed = False
+        if buffer_size > 0:
+            setvbuf(self.cfile, NULL, _IOFBF, buffer_size)
 
     def __enter__(self):
         return self
@@ -115,6 +137,7 @@ cdef class FortranFile:
         """
         cdef INT32_t s1, s2, size
         cdef np.ndarray data
+        cdef char* ptr
 
         if self._closed:
             raise ValueError("I/O operation on closed file.")
@@ -129,7 +152,10 @@ cdef class FortranFile:
                              'size (%s) of multi-item record' % (s1, size))
 
         data = np.empty(s1 // size, dtype=dtype)
-        fread(<void *>data.data, size, s1 // size, self.cfile)
+        ptr = <char *>data.data
+        # Release the GIL while reading, so that other threads can run
+        with nogil:
+            fread(<void *>ptr, size, s1 // size, self.cfile)
         fread(&s2, INT32_SIZE, 1, self.cfile)
 
         if s1 != s2:
@@ -138,6 +164,73 @@ cdef class FortranFile:
 
         return data
 
+    cpdef np.ndarray read_vectors(self, str dtype, INT64_t n):
+        """Reads n consecutive records of the same size from the file
+        and return them as a 2D numpy array.
+
+        This is equivalent to stacking the output of n calls to
+        `read_vector`, but the data is read straight into a single
+        array without going through Python for each record.
+
+        Parameters
+        ----------
+        dtype : data type
+            This is the datatype (from the struct module) that we should read.
+        n : integer
+            The number of records to read
+
+        Returns
+        -------
+        tr : numpy.ndarray
+            This is the (n, m) array of values read from the file, where m
+            is the number of elements in each record.
+
+        Examples
+        --------
+        >>> f = FortranFile("fort.3")
+        >>> rv = f.read_vectors("d", 8)  # Read 8 float64 records
+        """
+        cdef INT32_t s1, s2, size, rs
+        cdef INT64_t i
+        cdef np.ndarray data
+        cdef char* ptr
+
+        if self._closed:
+            raise ValueError("I/O operation on closed file.")
+
+        size = self.get_size(dtype)
+
+        if n <= 0:
+            return np.empty((0, 0), dtype=dtype)
+
+        # Get the size of the first record, all the others must match it
+        fread(&rs, INT32_SIZE, 1, self.cfile)
+        fseek(self.cfile, -INT32_SIZE, SEEK_CUR)
+
+        # Check record is compatible with data type
+        if rs % size != 0:
+            raise ValueError('Size obtained (%s) does not match with the expected '
+                             'size (%s) of multi-item record' % (rs, size))
+
+        data = np.empty((n, rs // size), dtype=dtype)
+        ptr = <char *>data.data
+
+        for i in range(n):
+            fread(&s1, INT32_SIZE, 1, self.cfile)
+            if s1 != rs:
+                raise IOError('Size of record %s (%s) differs from the size of '
+                              'the first record (%s)' % (i, s1, rs))
+            with nogil:
+                fread(<void *>ptr, size, rs // size, self.cfile)
+            fread(&s2, INT32_SIZE, 1, self.cfile)
+
+            if s1 != s2:
+                raise IOError('Sizes do not agree in the header and footer for '
+                              'this record - check header dtype')
+            ptr += rs
+
+        return data
+
     cpdef INT32_t read_int(self) except? -1:
         """Reads a single int32 from the file and return it.
 
@@ -159,14 +252,16 @@ cdef class FortranFile:
         if self._closed:
             raise ValueError("I/O operation on closed file.")
 
-        fread(&s1, INT32_SIZE, 1, self.cfile)
+        with nogil:
+            fread(&s1, INT32_SIZE, 1, self.cfile)
 
         if s1 != INT32_SIZE != 0:
             raise ValueError('Size obtained (%s) does not match with the expected '
                              'size (%s) of record' % (s1, INT32_SIZE))
 
-        fread(&data, INT32_SIZE, s1 // INT32_SIZE, self.cfile)
-        fread(&s2, INT32_SIZE, 1, self.cfile)
+        with nogil:
+            fread(&data, INT32_SIZE, s1 // INT32_SIZE, self.cfile)
+            fread(&s2, INT32_SIZE, 1, self.cfile)
 
         if s1 != s2:
             raise IOError('Sizes do not agree in the header and footer for '
@@ -266,7 +361,8 @@ cdef class FortranFile:
         if whence < 0 or whence > 2:
             raise ValueError("whence argument can be 0, 1, or 2. Got %s" % whence)
 
-        fseek(self.cfile, pos, whence)
+        with nogil:
+            fseek(self.cfile, pos, whence)
         return self.tell()
 
     cpdef void close(self):
@@ -0,0 +1,75 @@
+"""
+Tests for the Cython Fortran record reader
+
+
+
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2018, yt Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from yt.testing import \
+    assert_equal, \
+    assert_raises
+from yt.utilities.cython_fortran_utils import FortranFile
+
+
+def _write_records(fname, records):
+    with open(fname, 'wb') as f:
+        for rec in records:
+            rec = np.asarray(rec)
+            size = np.array([rec.nbytes], dtype='int32')
+            f.write(size.tobytes())
+            f.write(rec.tobytes())
+            f.write(size.tobytes())
+
+
+def test_read_vectors():
+    tmpdir = tempfile.mkdtemp()
+    fname = os.path.join(tmpdir, 'records.bin')
+    try:
+        records = [np.arange(5, dtype='float64') + 10*i for i in range(4)]
+        _write_records(fname, [np.array([42], dtype='int32')] + records)
+
+        with FortranFile(fname) as f:
+            assert_equal(f.read_int(), 42)
+            data = f.read_vectors('d', 4)
+            assert_equal(data.shape, (4, 5))
+            assert_equal(data, np.stack(records))
+
+            # The file should be positioned right after the last record
+            f.seek(0)
+            f.skip(1 + 4)
+            end = f.tell()
+            f.seek(0)
+            f.skip(1)
+            f.read_vectors('d', 4)
+            assert_equal(f.tell(), end)
+
+        # Records of different sizes cannot be read at once
+        _write_records(fname, [np.zeros(5), np.zeros(3)])
+        with FortranFile(fname) as f:
+            assert_raises(IOError, f.read_vectors, 'd', 2)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_open_missing_file():
+    tmpdir = tempfile.mkdtemp()
+    fname = os.path.join(tmpdir, 'missing.bin')
+    try:
+        assert_raises(IOError, FortranFile, fname)
+        assert_raises(IOError, FortranFile, fname, 1 << 20)
+    finally:
+        shutil.rmtree(tmpdir)